@@ -1,10 +1,23 @@
+import json
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+
 import streamlit as st
 import folium
 from streamlit_folium import st_folium
 from folium.plugins import Draw, MeasureControl
-from branca.element import JavascriptLink, MacroElement
+from branca.element import Element, MacroElement
+from folium.elements import JSCSSMixin
 from jinja2 import Template
-import geopy.geocoders
+
+from styling import DEFAULT_ICON_COLOR, ICON_INDEX, ICON_NAMES, LABEL_CSS, icon_html, label_html
+
+try:
+    import orjson  # optional: faster encoder for the label payload
+except ImportError:
+    orjson = None
 
 st.set_page_config(page_title="School Mini-Maps", layout="wide")
 
@@ -16,58 +29,68 @@ BASEMAPS = {
     "OSM Standard": {
         "base": "https://tile.openstreetmap.org/{z}/{x}/{y}.png",
         "labels": None,
-        "attr": "© OpenStreetMap contributors"
+        "attr": "© OpenStreetMap contributors",
+        "labels_default": True
     },
-    "CARTO Light (no labels)": {
+    "CARTO Light": {
         "base": "https://{s}.basemaps.cartocdn.com/light_nolabels/{z}/{x}/{y}{r}.png",
         "labels": "https://{s}.basemaps.cartocdn.com/light_only_labels/{z}/{x}/{y}{r}.png",
-        "attr": "© OpenStreetMap, © CARTO"
+        "attr": "© OpenStreetMap, © CARTO",
+        "labels_default": False
     },
-    "CARTO Light (with labels)": {
-        "base": "https://{s}.basemaps.cartocdn.com/light_nolabels/{z}/{x}/{y}{r}.png",
-        "labels": "https://{s}.basemaps.cartocdn.com/light_only_labels/{z}/{x}/{y}{r}.png",
-        "attr": "© OpenStreetMap, © CARTO"
-    },
-    "CARTO Dark (no labels)": {
+    "CARTO Dark": {
         "base": "https://{s}.basemaps.cartocdn.com/dark_nolabels/{z}/{x}/{y}{r}.png",
         "labels": "https://{s}.basemaps.cartocdn.com/dark_only_labels/{z}/{x}/{y}{r}.png",
-        "attr": "© OpenStreetMap, © CARTO"
+        "attr": "© OpenStreetMap, © CARTO",
+        "labels_default": False
     },
-    "CARTO Dark (with labels)": {
-        "base": "https://{s}.basemaps.cartocdn.com/dark_nolabels/{z}/{x}/{y}{r}.png",
-        "labels": "https://{s}.basemaps.cartocdn.com/dark_only_labels/{z}/{x}/{y}{r}.png",
-        "attr": "© OpenStreetMap, © CARTO"
+    "CARTO Positron (vector)": {
+        "base": None,
+        "labels": None,
+        "style": "https://basemaps.cartocdn.com/gl/positron-gl-style/style.json",
+        # Style JSON host, plus the host serving its vector tiles, glyphs and sprites
+        "preconnect": ["basemaps.cartocdn.com", "tiles.basemaps.cartocdn.com"],
+        "attr": "© OpenStreetMap, © CARTO",
+        "labels_default": False
     },
     "Stamen Toner (background + labels)": {
-        "base": "https://stamen-tiles-{s}.a.ssl.fastly.net/toner-background/{z}/{x}/{y}.png",
-        "labels": "https://stamen-tiles-{s}.a.ssl.fastly.net/toner-labels/{z}/{x}/{y}.png",
-        "attr": "Map tiles by Stamen Design, CC BY 3.0. Data © OSM."
+        # Stamen tiles are now served by Stadia Maps from a single HTTP/2 host
+        "base": "https://tiles.stadiamaps.com/tiles/stamen_toner_background/{z}/{x}/{y}{r}.png",
+        "labels": "https://tiles.stadiamaps.com/tiles/stamen_toner_labels/{z}/{x}/{y}{r}.png",
+        "attr": "© Stadia Maps, © Stamen Design, © OpenMapTiles, © OpenStreetMap",
+        "labels_default": True
     },
 }
+BASEMAP_NAMES = tuple(BASEMAPS)
+# Keep more off-screen tiles around for panning back, and don't fetch
+# intermediate levels mid-zoom animation
+TILE_OPTIONS = {"keep_buffer": 4, "update_when_zooming": False}
+DEFAULT_BASEMAP_INDEX = BASEMAP_NAMES.index("CARTO Light")
+
+LABEL_STYLES = ("Filled (orange)", "Label", "Outlined")
+STYLE_INDEX = {name: i for i, name in enumerate(LABEL_STYLES)}
 
 # --------------------------------
-# Helpers (color + rgba)
+# Helpers
 # --------------------------------
-def hex_to_rgb(h: str):
-    h = (h or "").lstrip("#") or "FFFFFF"
-    return tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
-
-def rgba_from_hex(hex_color: str, alpha: float) -> str:
-    r, g, b = hex_to_rgb(hex_color or "#FFFFFF")
-    a = max(0.0, min(1.0, float(alpha)))
-    return f"rgba({r},{g},{b},{a})"
+def dumps_compact(obj) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+def tile_hosts(url: str, subdomains: str = "abc"):
+    # Expand Leaflet's {s} placeholder the same way TileLayer does by default
+    host = url.split("/")[2]
+    if "{s}" not in host:
+        return [host]
+    return [host.replace("{s}", s) for s in subdomains]
 
 # Hi-res PNG print button
-class HiResPrint(MacroElement):
-    _template = Template("""
-    {% macro script(this, kwargs) %}
+# Plain %-formatted JS; only the map variable, file name and position vary.
+HIRES_PRINT_JS = """
     (function(){
-      var map = {{this._parent.get_name()}};
-      if (!(window.L && L.easyPrint)) {
-        console.warn('easyPrint plugin not loaded; export disabled');
-        return;
-      }
-      var originalSize;
+      var map = %(map)s;
+      var originalSize, printer, loading;
 
       function resizeMap(factor){
         var el = map.getContainer();
@@ -79,20 +102,66 @@ class HiResPrint(MacroElement):
         map.invalidateSize(true);
       }
 
-      var printer = L.easyPrint({
-        tileLayer: null,
-        sizeModes: ['CurrentSize'],
-        filename: '{{this.file_name}}',
-        exportOnly: true,
-        hideControlContainer: true
-      }).addTo(map);
+      // easyPrint is only fetched the first time someone exports
+      function withPrinter(fn){
+        if (printer) return fn();
+        if (loading) return;  // extra clicks while the script loads are dropped
+        loading = true;
+        var s = document.createElement('script');
+        s.src = '%(easyprint_url)s';
+        s.onload = function(){
+          printer = L.easyPrint({
+            tileLayer: null,
+            sizeModes: ['CurrentSize'],
+            filename: '%(file_name)s',
+            exportOnly: true,
+            hideControlContainer: true,
+            hidden: true
+          }).addTo(map);
+          loading = false;
+          fn();
+        };
+        s.onerror = function(){
+          console.warn('easyPrint plugin failed to load; export disabled');
+          loading = false;
+        };
+        document.head.appendChild(s);
+      }
 
+      // Looked up once: the controls present at the first export are the
+      // ones hidden and shown again around every later export.
+      var controls;
       function toggleControls(show){
-        var els = document.querySelectorAll(".leaflet-control, .leaflet-draw, .leaflet-bar");
-        els.forEach(function(e){ e.style.display = show ? "" : "none"; });
+        if (!controls) controls = map.getContainer().querySelectorAll(".leaflet-control, .leaflet-draw, .leaflet-bar");
+        for (var i = 0; i < controls.length; i++) controls[i].style.display = show ? "" : "none";
+      }
+
+      // Run fn once every tile layer has finished loading at the new size,
+      // falling back to a timeout so one stuck tile can't block the export.
+      function whenTilesLoaded(fn){
+        var pending = [];
+        map.eachLayer(function(l){
+          if (l instanceof L.GridLayer && l.isLoading()) pending.push(l);
+        });
+        var done = false;
+        function finish(){ if (!done){ done = true; fn(); } }
+        if (!pending.length) return finish();
+        var left = pending.length;
+        pending.forEach(function(l){
+          l.once('load', function(){ if (--left === 0) finish(); });
+        });
+        setTimeout(finish, 3000);
       }
 
-      var btn = L.control({position: '{{this.position}}'});
+      function restore(){
+        var el = map.getContainer();
+        el.style.width  = originalSize.w + "px";
+        el.style.height = originalSize.h + "px";
+        toggleControls(true);
+        map.invalidateSize(true);
+      }
+
+      var btn = L.control({position: '%(position)s'});
       btn.onAdd = function(){
         var div = L.DomUtil.create('div','leaflet-bar');
         var a = L.DomUtil.create('a','',div);
@@ -104,24 +173,41 @@ class HiResPrint(MacroElement):
         a.style.lineHeight = '30px';
         L.DomEvent.on(a, 'click', function(e){
           L.DomEvent.stop(e);
-          toggleControls(false);
-          resizeMap(2);
-          setTimeout(function(){
-            printer.printMap('CurrentSize', '{{this.file_name}}');
-            setTimeout(function(){
-              var el = map.getContainer();
-              el.style.width  = originalSize.w + "px";
-              el.style.height = originalSize.h + "px";
-              toggleControls(true);
-              map.invalidateSize(true);
-            }, 500);
-          }, 500);
+          withPrinter(function(){
+            toggleControls(false);
+            resizeMap(2);
+            // Let the resize hit the DOM, then print once the 2x tiles are in
+            requestAnimationFrame(function(){
+              whenTilesLoaded(function(){
+                // easyPrint never fires 'easyPrint-finished' when the capture
+                // fails, so also restore after a generous timeout.
+                var done = false;
+                function finish(){
+                  if (done) return;
+                  done = true;
+                  map.off('easyPrint-finished', finish);
+                  restore();
+                }
+                map.once('easyPrint-finished', finish);
+                setTimeout(finish, 20000);
+                printer.printMap('CurrentSize', '%(file_name)s');
+              });
+            });
+          });
         });
         return div;
       };
       btn.addTo(map);
     })();
-    {% endmacro %}
+"""
+
+EASYPRINT_JS_URL = "https://unpkg.com/leaflet-easyprint@2.1.9/dist/bundle.min.js"
+
+class HiResPrint(MacroElement):
+    # st_folium renders elements through the template's script macro, so keep
+    # a minimal one that just emits the pre-formatted body.
+    _template = Template("""
+    {% macro script(this, kwargs) %}{{ this.script_js() }}{% endmacro %}
     """)
     def __init__(self, file_name="map_export_2x", position="topleft"):
         super().__init__()
@@ -129,20 +215,133 @@ class HiResPrint(MacroElement):
         self.file_name = file_name
         self.position = position
 
-# SVG icon set
-ICON_SVGS = {
-    "Entrance": "<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 32 32'><path d='M2 4h18v24H2z'/><path d='M20 16H8l4-4-2-2-8 8 8 8 2-2-4-4h12z'/></svg>",
-    "Parking":  "<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 32 32'><path d='M6 4h12a8 8 0 010 16H6z'/><rect x='6' y='20' width='6' height='8'/></svg>",
-    "Info":     "<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 32 32'><circle cx='16' cy='16' r='14'/><rect x='15' y='12' width='2' height='12'/><circle cx='16' cy='8' r='2'/></svg>",
-    "Caution":  "<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 32 32'><path d='M16 4l14 24H2z'/><rect x='15' y='12' width='2' height='8'/><rect x='15' y='22' width='2' height='2'/></svg>",
-    "Office":   "<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 32 32'><rect x='4' y='6' width='24' height='20'/><rect x='8' y='10' width='6' height='6'/><rect x='18' y='10' width='6' height='6'/></svg>",
-}
+    def script_js(self):
+        return HIRES_PRINT_JS % {
+            "map": self._parent.get_name(),
+            "file_name": self.file_name,
+            "position": self.position,
+            "easyprint_url": EASYPRINT_JS_URL,
+        }
 
-def colorize_svg(svg: str, fill: str) -> str:
-    return (svg
-            .replace("<path", f"<path fill='{fill}'")
-            .replace("<circle", f"<circle fill='{fill}'")
-            .replace("<rect", f"<rect fill='{fill}'"))
+# All labels in one JSON payload, turned into markers by a single JS loop
+# instead of one folium Marker + DivIcon (and template render) per label.
+class LabelLayer(MacroElement):
+    _template = Template("""
+    {% macro script(this, kwargs) %}
+    {{ this.markers_json }}.forEach(function(l){
+        L.marker([l[0], l[1]], {
+            draggable: true,
+            autoPan: true,
+            icon: L.divIcon({html: l[2], className: "empty"})
+        }).addTo({{ this._parent.get_name() }});
+    });
+    {% endmacro %}
+    """)
+    def __init__(self, markers):
+        super().__init__()
+        self._name = "LabelLayer"
+        # Keep "</div>" etc. from ever closing the surrounding <script>
+        self.markers_json = dumps_compact(markers).replace("</", "<\\/")
+
+# Vector basemap: one style.json + vector tiles rendered client-side by MapLibre
+class VectorBasemap(JSCSSMixin, MacroElement):
+    default_js = [
+        ("maplibre-gl", "https://unpkg.com/maplibre-gl@3.6.2/dist/maplibre-gl.js"),
+        ("maplibre-gl-leaflet", "https://unpkg.com/@maplibre/maplibre-gl-leaflet@0.0.20/leaflet-maplibre-gl.js"),
+    ]
+    default_css = [
+        ("maplibre-gl-css", "https://unpkg.com/maplibre-gl@3.6.2/dist/maplibre-gl.css"),
+    ]
+    _template = Template("""
+    {% macro script(this, kwargs) %}
+    L.maplibreGL({{ this.options|tojson }}).addTo({{ this._parent.get_name() }});
+    {% endmacro %}
+    """)
+    def __init__(self, style_url, attr=""):
+        super().__init__()
+        self._name = "VectorBasemap"
+        self.options = {"style": style_url, "attribution": attr}
+
+# --------------------------------
+# Map builder
+# --------------------------------
+# Cached on its inputs so unrelated reruns skip rebuilding the Folium tree.
+# cache_data (not cache_resource) on purpose: every hit is a fresh copy, and
+# st_folium calls feature_group_to_add.add_to(map) on every call, so a shared
+# instance would pick up another label layer each rerun.
+@st.cache_data(max_entries=32, show_spinner=False)
+def create_folium_map(lat, lon, zoom, basemap_choice, show_label_overlay, show_school_marker,
+                      marker_tooltip, draw_color, draw_weight):
+    bm = BASEMAPS[basemap_choice]
+    base_tiles_url = bm["base"]
+    labels_tiles_url = bm["labels"]
+    vector_style_url = bm.get("style")
+    attr = bm["attr"]
+
+    m = folium.Map(location=[lat, lon], zoom_start=zoom, tiles=None, control_scale=False, zoom_control=True)
+
+    # Open connections to the tile servers while Leaflet is still booting
+    tile_urls = ([base_tiles_url] if base_tiles_url else []) + ([labels_tiles_url] if labels_tiles_url and show_label_overlay else [])
+    hosts = dict.fromkeys(bm.get("preconnect", []) + [h for url in tile_urls for h in tile_hosts(url)])
+    for host in hosts:
+        m.get_root().header.add_child(Element(f'<link rel="preconnect" href="https://{host}">'))
+    # Label styles, referenced by class from the labels layer
+    m.get_root().header.add_child(Element(f"<style>{LABEL_CSS}</style>"))
+
+    if vector_style_url:
+        # WebGL canvas: the 2x PNG export may not capture this basemap
+        VectorBasemap(vector_style_url, attr=attr).add_to(m)
+    else:
+        folium.TileLayer(tiles=base_tiles_url, attr=attr, max_zoom=20, name="base", **TILE_OPTIONS).add_to(m)
+    if labels_tiles_url and show_label_overlay:
+        folium.TileLayer(tiles=labels_tiles_url, attr=attr, max_zoom=20, name="labels", **TILE_OPTIONS).add_to(m)
+
+    if show_school_marker:
+        folium.CircleMarker([lat, lon], radius=6, color="#000", fill=True, fill_opacity=1, tooltip=marker_tooltip).add_to(m)
+
+    Draw(
+        export=True,
+        filename=f"map_drawings.geojson",
+        position="topleft",
+        draw_options={
+            "polyline": {"shapeOptions": {"color": draw_color, "weight": draw_weight}},
+            "rectangle": {"shapeOptions": {"color": draw_color, "weight": draw_weight}},
+            "polygon": {"shapeOptions": {"color": draw_color, "weight": draw_weight}},
+            "circle": {"shapeOptions": {"color": draw_color, "weight": draw_weight}},
+            "circlemarker": {"shapeOptions": {"color": draw_color, "weight": draw_weight}},
+            "marker": False
+        },
+        edit_options={"edit": True, "remove": True},
+    ).add_to(m)
+
+    m.add_child(MeasureControl(primary_length_unit="miles"))
+
+    try:
+        m.add_child(HiResPrint(file_name="map_export_2x"))
+    except Exception as e:
+        st.warning(f"Hi-res print disabled: {e}")
+
+    return m
+
+# Labels and icons go in their own layer, handed to st_folium as
+# feature_group_to_add: editing them swaps this layer in place instead of
+# remounting the base map (tiles, drawings and view are kept).
+@st.cache_data(max_entries=32, show_spinner=False)
+def create_label_group(labels):
+    fg = folium.FeatureGroup(name="elements")
+
+    # Robust label rendering
+    markers = []
+    for idx, lab in enumerate(labels):
+        try:
+            # Text labels carry their HTML from add/apply time, like icons carry "svg"
+            html = lab["svg"] if lab.get("style") == "SVG_ICON" else lab.get("html") or label_html(lab)
+            markers.append((float(lab["lat"]), float(lab["lon"]), html))
+        except Exception as e:
+            st.warning(f"Error rendering label {idx}: {e}. Skipping...")
+
+    LabelLayer(markers).add_to(fg)
+    return fg
 
 # --------------------------------
 # Session state
@@ -153,8 +352,22 @@ if "last_clicked" not in st.session_state:
     st.session_state.last_clicked = None
 if "selected_label_idx" not in st.session_state:
     st.session_state.selected_label_idx = 0
+if "next_selected_idx" in st.session_state:
+    # Set by delete/clear; the select widget's key can only be written before it exists
+    st.session_state.selected_label_idx = st.session_state.pop("next_selected_idx")
 if "address_coords" not in st.session_state:
     st.session_state.address_coords = (33.9239, -118.2620) # Default location
+if "labels_rev" not in st.session_state:
+    st.session_state.labels_rev = 0 # Bumped on every labels mutation
+
+def label_options():
+    # Dropdown captions, rebuilt only when the labels change
+    key = (st.session_state.labels_rev, len(st.session_state.labels))
+    cached_key, options = st.session_state.get("label_options_cache", (None, None))
+    if cached_key != key:
+        options = [f"{i}: {lab.get('text', lab.get('base_svg_key'))}" for i, lab in enumerate(st.session_state.labels)]
+        st.session_state.label_options_cache = (key, options)
+    return options
 
 # --------------------------------
 # App layout
@@ -163,26 +376,75 @@ st.title("School Mini-Maps")
 
 basemap_choice = st.sidebar.selectbox(
     "Basemap preset",
-    list(BASEMAPS.keys()),
-    index=list(BASEMAPS.keys()).index("CARTO Light (no labels)")
+    BASEMAP_NAMES,
+    index=DEFAULT_BASEMAP_INDEX
 )
 show_label_overlay = st.sidebar.toggle(
     "Show labels overlay",
-    value=("with labels" in basemap_choice or "OSM" in basemap_choice or "Stamen" in basemap_choice)
+    value=BASEMAPS[basemap_choice]["labels_default"]
 )
 
 # Address input for map centering
 address_input = st.sidebar.text_input("Enter Address or Name", "Samuel Gompers Middle School")
 search_button = st.sidebar.button("Go to Address")
 
+# Successful lookups also go to a small SQLite file so they survive restarts
+# (Nominatim is slow and rate-limited). Any DB problem just means a miss.
+GEOCODE_DB = Path(__file__).with_name("geocode_cache.db")
+GEOCODE_DB_TTL = 30 * 24 * 3600  # seconds
+
+def _geocache_conn():
+    # Checked on every connection so a deleted or replaced DB file recovers
+    conn = sqlite3.connect(GEOCODE_DB)
+    conn.execute("CREATE TABLE IF NOT EXISTS geocode (address TEXT PRIMARY KEY, lat REAL, lon REAL, ts INTEGER)")
+    return conn
+
+def _geocache_get(address):
+    try:
+        with closing(_geocache_conn()) as conn:
+            return conn.execute(
+                "SELECT lat, lon FROM geocode WHERE address = ? AND ts > ?",
+                (address, int(time.time()) - GEOCODE_DB_TTL),
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+
+def _geocache_put(address, lat, lon):
+    try:
+        with closing(_geocache_conn()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?)", (address, lat, lon, int(time.time())))
+    except sqlite3.Error:
+        pass
+
+# One Nominatim client (and its HTTP session) per process.
+@st.cache_resource(show_spinner=False)
+def get_geolocator():
+    # geopy is only needed once someone searches, so keep it off the startup path
+    import geopy.geocoders
+    return geopy.geocoders.Nominatim(user_agent="streamlit_app")
+
 # Geocoding function to get coordinates from address
 @st.cache_data(ttl=3600)
 def geocode_address(address):
+    if not address or not address.strip():
+        return None, None
+    # "lat, lon" typed straight into the box needs no lookup at all
+    try:
+        lat, lon = (float(part) for part in address.split(","))
+    except ValueError:
+        pass
+    else:
+        if -90 <= lat <= 90 and -180 <= lon <= 180:
+            return lat, lon
+
+    cached = _geocache_get(address)
+    if cached:
+        return cached
     from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
     try:
-        geolocator = geopy.geocoders.Nominatim(user_agent="streamlit_app")
-        location = geolocator.geocode(address, timeout=10)
+        location = get_geolocator().geocode(address, timeout=10)
         if location:
+            _geocache_put(address, location.latitude, location.longitude)
             return location.latitude, location.longitude
         return None, None
     except (GeocoderTimedOut, GeocoderUnavailable) as e:
@@ -205,9 +467,10 @@ if search_button:
 
 lat, lon = st.session_state.get("address_coords", (33.9239, -118.2620))
 
-left, right = st.columns([2.2, 1])
-
-with left:
+# The map column runs as a fragment: its own widgets and map interactions
+# rerun only this function, not the sidebar, geocoding or the edit panel.
+@st.fragment
+def map_panel(lat, lon, basemap_choice, show_label_overlay, marker_tooltip):
     c1, c2, c3, c4 = st.columns(4)
     with c1:
         zoom = st.slider("Zoom", 12, 20, 16, key="zoom")
@@ -218,75 +481,16 @@ with left:
     with c4:
         draw_color = st.color_picker("Drawing color", "#FF0000", key="draw_color")
 
-    # Tiles
-    bm = BASEMAPS[basemap_choice]
-    base_tiles_url = bm["base"]
-    labels_tiles_url = bm["labels"]
-    attr = bm["attr"]
-
-    # Map builder function
-    def create_folium_map():
-        m = folium.Map(location=[lat, lon], zoom_start=zoom, tiles=None, control_scale=False, zoom_control=True)
-        folium.TileLayer(tiles=base_tiles_url, attr=attr, max_zoom=20, name="base").add_to(m)
-        if labels_tiles_url and show_label_overlay:
-            folium.TileLayer(tiles=labels_tiles_url, attr=attr, max_zoom=20, name="labels").add_to(m)
-
-        if show_school_marker:
-            folium.CircleMarker([lat, lon], radius=6, color="#000", fill=True, fill_opacity=1, tooltip=address_input).add_to(m)
-
-        Draw(
-            export=True,
-            filename=f"map_drawings.geojson",
-            position="topleft",
-            draw_options={
-                "polyline": {"shapeOptions": {"color": draw_color, "weight": draw_weight}},
-                "rectangle": {"shapeOptions": {"color": draw_color, "weight": draw_weight}},
-                "polygon": {"shapeOptions": {"color": draw_color, "weight": draw_weight}},
-                "circle": {"shapeOptions": {"color": draw_color, "weight": draw_weight}},
-                "circlemarker": {"shapeOptions": {"color": draw_color, "weight": draw_weight}},
-                "marker": False
-            },
-            edit_options={"edit": True, "remove": True},
-        ).add_to(m)
-
-        m.add_child(MeasureControl(primary_length_unit="miles"))
-
-        # Robust label rendering
-        for idx, lab in enumerate(st.session_state.labels):
-            try:
-                if lab.get("style") == "SVG_ICON":
-                    folium.Marker([lab["lat"], lab["lon"]], draggable=True, icon=folium.DivIcon(html=lab["svg"])).add_to(m)
-                else:
-                    style = lab.get("style", "Label")
-                    size = lab.get("size", 16)
-                    color = lab.get("color", "#111")
-                    
-                    html_style = ""
-                    if style == "Label":
-                        bg = rgba_from_hex(lab.get("bg_hex", "#FFFFFF"), lab.get("bg_alpha", 0.8))
-                        html_style = f"font-weight:700;font-size:{size}px;color:{color};background:{bg};padding:2px 6px;border:1px solid {color};border-radius:3px"
-                    elif style == "Outlined":
-                        html_style = f"font-weight:800;font-size:{size}px;color:{color};-webkit-text-stroke:2px #fff;text-shadow:0 0 2px #fff"
-                    else:
-                        html_style = f"font-weight:800;font-size:{size}px;color:{color};border:2px solid {color};background:{lab.get('fillcolor', '#f6a500')};padding:4px 8px;border-radius:3px"
-
-                    html = f"<div style='{html_style}'>{lab['text']}</div>"
-                    folium.Marker([lab["lat"], lab["lon"]], draggable=True, icon=folium.DivIcon(html=html)).add_to(m)
-            except Exception as e:
-                st.warning(f"Error rendering label {idx}: {e}. Skipping...")
-
-        return m
-
-    m = create_folium_map()
-
-    try:
-        m.get_root().header.add_child(JavascriptLink("https://unpkg.com/leaflet-easyprint@2.1.9/dist/bundle.min.js"))
-        m.add_child(HiResPrint(file_name="map_export_2x"))
-    except Exception as e:
-        st.warning(f"Hi-res print disabled: {e}")
+    m = create_folium_map(
+        lat, lon, zoom, basemap_choice, show_label_overlay, show_school_marker,
+        marker_tooltip, draw_color, draw_weight,
+    )
+    fg = create_label_group(st.session_state.labels)
 
     st.caption("Draw shapes. Click the map to add a new label or icon.")
-    map_state = st_folium(m, height=600, width=None, key="map")
+    # Only the click is read back; drawings are exported client-side by Draw
+    map_state = st_folium(m, height=600, width=None, key="map", feature_group_to_add=fg,
+                          returned_objects=["last_clicked"])
 
     if map_state.get("last_clicked") and map_state["last_clicked"] != st.session_state.last_clicked:
         st.session_state.last_clicked = map_state["last_clicked"]
@@ -294,7 +498,7 @@ with left:
         lonc = float(st.session_state.last_clicked["lng"])
         
         if st.session_state.get("add_mode", "label") == "label":
-            st.session_state.labels.append({
+            new_label = {
                 "lat": latc,
                 "lon": lonc,
                 "text": "New Label",
@@ -303,13 +507,14 @@ with left:
                 "color": "#111",
                 "bg_hex": "#FFFFFF",
                 "bg_alpha": 0.8
-            })
+            }
+            new_label["html"] = label_html(new_label)
+            st.session_state.labels.append(new_label)
         else:
             icon_name = st.session_state.get("icon_to_add", "Info")
             icon_size = st.session_state.get("icon_size_add", 28)
-            icon_color = st.session_state.get("icon_color_add", "#111111")
-            svg = colorize_svg(ICON_SVGS[icon_name], icon_color)
-            html = f"<div style='width:{icon_size}px;height:{icon_size}px'>{svg}</div>"
+            icon_color = st.session_state.get("icon_color_add", DEFAULT_ICON_COLOR)
+            html = icon_html(icon_name, icon_color, icon_size)
             st.session_state.labels.append({
                 "lat": latc, 
                 "lon": lonc, 
@@ -319,10 +524,20 @@ with left:
                 "base_svg_key": icon_name,
                 "color": icon_color
             })
-        
-        st.experimental_rerun()
-    
-with right:
+
+        st.session_state.labels_rev += 1
+        # Full-app rerun so the new element also shows up in the edit panel
+        st.rerun()
+
+left, right = st.columns([2.2, 1])
+
+with left:
+    map_panel(lat, lon, basemap_choice, show_label_overlay, address_input)
+
+# Tweaking the add/edit widgets only reruns this panel. Applying a change
+# still calls st.rerun() (app scope) so the map picks up the new labels.
+@st.fragment
+def element_panel():
     st.subheader("Add new element")
     add_mode = st.radio("What to add on click?", ["Text Label", "Icon"], key="add_mode_select", horizontal=True)
     st.session_state["add_mode"] = "label" if add_mode == "Text Label" else "icon"
@@ -332,7 +547,7 @@ with right:
     if add_mode == "Text Label":
         st.divider()
         new_text = st.text_input("Default Text", value="New Label")
-        new_style = st.selectbox("Style", ["Filled (orange)", "Label", "Outlined"], index=1)
+        new_style = st.selectbox("Style", LABEL_STYLES, index=1)
         new_size = st.slider("Size (px)", 10, 36, 16)
         if new_style == "Filled (orange)":
             new_fill_color = st.color_picker("Fill color", "#f6a500")
@@ -344,71 +559,88 @@ with right:
 
     else:
         st.divider()
-        icon_name = st.selectbox("Icon", list(ICON_SVGS.keys()), key="icon_to_add")
+        icon_name = st.selectbox("Icon", ICON_NAMES, key="icon_to_add")
         icon_size = st.slider("Icon size", 16, 96, 28, key="icon_size_add")
-        icon_color = st.color_picker("Icon color", "#111111", key="icon_color_add")
+        icon_color = st.color_picker("Icon color", DEFAULT_ICON_COLOR, key="icon_color_add")
     
     st.divider()
     st.subheader("Edit existing elements")
     if not st.session_state.labels:
         st.info("No labels or icons yet.")
     else:
-        label_options = [
-            f"{i}: {lab.get('text', lab.get('base_svg_key'))}" for i, lab in enumerate(st.session_state.labels)
-        ]
-        selected_label_index = st.selectbox("Select an element to edit", range(len(st.session_state.labels)), format_func=lambda x: label_options[x], key="selected_label_idx")
+        options = label_options()
+        selected_label_index = st.selectbox("Select an element to edit", range(len(st.session_state.labels)), format_func=options.__getitem__, key="selected_label_idx")
 
         lab = st.session_state.labels[selected_label_index]
         
+        # Edits are batched in a form: typing or dragging a picker doesn't
+        # rerun anything until Apply is pressed.
         if lab.get("style") == "SVG_ICON":
-            new_icon_name = st.selectbox("Icon type", list(ICON_SVGS.keys()), index=list(ICON_SVGS.keys()).index(lab.get("base_svg_key", "Info")), key=f"edit_icon_name_{selected_label_index}")
-            new_icon_size = st.slider("Icon size", 16, 96, lab.get("size", 28), key=f"edit_icon_size_{selected_label_index}")
-            new_icon_color = st.color_picker("Icon color", lab.get("color", "#111111"), key=f"edit_icon_color_{selected_label_index}")
-            
-            if st.button("Apply icon changes", use_container_width=True, key=f"apply_icon_{selected_label_index}"):
-                svg = colorize_svg(ICON_SVGS[new_icon_name], new_icon_color)
-                lab["size"] = new_icon_size
-                lab["color"] = new_icon_color
-                lab["base_svg_key"] = new_icon_name
-                lab["svg"] = f"<div style='width:{new_icon_size}px;height:{new_icon_size}px'>{svg}</div>"
-                st.experimental_rerun()
+            with st.form(f"edit_icon_form_{selected_label_index}", border=False):
+                new_icon_name = st.selectbox("Icon type", ICON_NAMES, index=ICON_INDEX.get(lab.get("base_svg_key"), ICON_INDEX["Info"]), key=f"edit_icon_name_{selected_label_index}")
+                new_icon_size = st.slider("Icon size", 16, 96, lab.get("size", 28), key=f"edit_icon_size_{selected_label_index}")
+                new_icon_color = st.color_picker("Icon color", lab.get("color", DEFAULT_ICON_COLOR), key=f"edit_icon_color_{selected_label_index}")
+                apply_icon = st.form_submit_button("Apply icon changes", use_container_width=True)
+
+            if apply_icon:
+                updated = dict(lab,
+                               size=new_icon_size,
+                               color=new_icon_color,
+                               base_svg_key=new_icon_name,
+                               svg=icon_html(new_icon_name, new_icon_color, new_icon_size))
+                # Nothing changed: skip the rerun (and the map refresh) entirely
+                if updated != lab:
+                    st.session_state.labels[selected_label_index] = updated
+                    st.session_state.labels_rev += 1
+                    st.rerun()
         else:
-            new_text = st.text_input("Text", value=lab.get("text", ""), key=f"edit_text_{selected_label_index}")
-            new_style = st.selectbox("Style", ["Filled (orange)", "Label", "Outlined"], index=["Filled (orange)", "Label", "Outlined"].index(lab.get("style", "Label")), key=f"edit_style_{selected_label_index}")
-            new_size = st.slider("Size (px)", 10, 36, lab.get("size", 16), key=f"edit_size_{selected_label_index}")
-            
-            if new_style == "Filled (orange)":
-                new_fill_color = st.color_picker("Fill color", lab.get("fillcolor", "#f6a500"), key=f"edit_fillcolor_{selected_label_index}")
-                new_text_color = st.color_picker("Text color", lab.get("color", "#111111"), key=f"edit_textcolor_{selected_label_index}")
-            else:
-                new_text_color = st.color_picker("Text color", lab.get("color", "#111111"), key=f"edit_textcolor_{selected_label_index}")
-                new_bg_hex = st.color_picker("Background color", lab.get("bg_hex", "#FFFFFF"), key=f"edit_bg_hex_{selected_label_index}")
-                new_bg_alpha = st.slider("Background opacity", 0.0, 1.0, float(lab.get("bg_alpha", 0.8)), key=f"edit_bg_alpha_{selected_label_index}")
-
-            if st.button("Apply text changes", use_container_width=True, key=f"apply_text_{selected_label_index}"):
-                lab["text"] = new_text
-                lab["style"] = new_style
-                lab["size"] = new_size
-                lab["color"] = new_text_color
+            # Outside the form so the color fields below follow the chosen style
+            new_style = st.selectbox("Style", LABEL_STYLES, index=STYLE_INDEX.get(lab.get("style"), STYLE_INDEX["Label"]), key=f"edit_style_{selected_label_index}")
+
+            with st.form(f"edit_text_form_{selected_label_index}", border=False):
+                new_text = st.text_input("Text", value=lab.get("text", ""), key=f"edit_text_{selected_label_index}")
+                new_size = st.slider("Size (px)", 10, 36, lab.get("size", 16), key=f"edit_size_{selected_label_index}")
+
                 if new_style == "Filled (orange)":
-                    lab["fillcolor"] = new_fill_color
-                    lab.pop("bg_hex", None)
-                    lab.pop("bg_alpha", None)
+                    new_fill_color = st.color_picker("Fill color", lab.get("fillcolor", "#f6a500"), key=f"edit_fillcolor_{selected_label_index}")
+                    new_text_color = st.color_picker("Text color", lab.get("color", "#111111"), key=f"edit_textcolor_{selected_label_index}")
                 else:
-                    lab["bg_hex"] = new_bg_hex
-                    lab["bg_alpha"] = float(new_bg_alpha)
-                    lab.pop("fillcolor", None)
-                st.experimental_rerun()
+                    new_text_color = st.color_picker("Text color", lab.get("color", "#111111"), key=f"edit_textcolor_{selected_label_index}")
+                    new_bg_hex = st.color_picker("Background color", lab.get("bg_hex", "#FFFFFF"), key=f"edit_bg_hex_{selected_label_index}")
+                    new_bg_alpha = st.slider("Background opacity", 0.0, 1.0, float(lab.get("bg_alpha", 0.8)), key=f"edit_bg_alpha_{selected_label_index}")
+
+                apply_text = st.form_submit_button("Apply text changes", use_container_width=True)
+
+            if apply_text:
+                updated = dict(lab, text=new_text, style=new_style, size=new_size, color=new_text_color)
+                if new_style == "Filled (orange)":
+                    updated["fillcolor"] = new_fill_color
+                    updated.pop("bg_hex", None)
+                    updated.pop("bg_alpha", None)
+                else:
+                    updated["bg_hex"] = new_bg_hex
+                    updated["bg_alpha"] = float(new_bg_alpha)
+                    updated.pop("fillcolor", None)
+                updated["html"] = label_html(updated)
+                if updated != lab:
+                    st.session_state.labels[selected_label_index] = updated
+                    st.session_state.labels_rev += 1
+                    st.rerun()
 
         st.divider()
         col1, col2 = st.columns(2)
         with col1:
             if st.button("Delete Selected Element", use_container_width=True, key=f"delete_button_{selected_label_index}"):
                 st.session_state.labels.pop(selected_label_index)
-                st.session_state.selected_label_idx = max(0, selected_label_index - 1)
-                st.experimental_rerun()
+                st.session_state.labels_rev += 1
+                st.session_state.next_selected_idx = max(0, selected_label_index - 1)
+                st.rerun()
         with col2:
             if st.button("Clear All Elements", use_container_width=True, key="clear_all_button"):
                 st.session_state.labels = []
-                st.session_state.selected_label_idx = 0
-                st.experimental_rerun()
+                st.session_state.labels_rev += 1
+                st.session_state.next_selected_idx = 0
+                st.rerun()
+
+with right:
+    element_panel()
@@ -0,0 +1,90 @@
+# Pure color / icon / label-HTML helpers.
+# Kept out of app.py on purpose: Streamlit re-executes the main script on
+# every rerun, which would recreate these functions and empty their
+# lru_caches each time. An imported module is loaded once per process.
+import re
+from functools import lru_cache
+
+# --------------------------------
+# Color helpers
+# --------------------------------
+@lru_cache(maxsize=256)
+def hex_to_rgb(h: str):
+    h = (h or "").lstrip("#") or "FFFFFF"
+    return tuple(bytes.fromhex(h[:6]))
+
+@lru_cache(maxsize=512)
+def rgba_from_hex(hex_color: str, alpha: float) -> str:
+    r, g, b = hex_to_rgb(hex_color or "#FFFFFF")
+    a = max(0.0, min(1.0, float(alpha)))
+    return f"rgba({r},{g},{b},{a})"
+
+# --------------------------------
+# SVG icons
+# --------------------------------
+ICON_SVGS = {
+    "Entrance": "<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 32 32'><path d='M2 4h18v24H2z'/><path d='M20 16H8l4-4-2-2-8 8 8 8 2-2-4-4h12z'/></svg>",
+    "Parking":  "<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 32 32'><path d='M6 4h12a8 8 0 010 16H6z'/><rect x='6' y='20' width='6' height='8'/></svg>",
+    "Info":     "<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 32 32'><circle cx='16' cy='16' r='14'/><rect x='15' y='12' width='2' height='12'/><circle cx='16' cy='8' r='2'/></svg>",
+    "Caution":  "<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 32 32'><path d='M16 4l14 24H2z'/><rect x='15' y='12' width='2' height='8'/><rect x='15' y='22' width='2' height='2'/></svg>",
+    "Office":   "<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 32 32'><rect x='4' y='6' width='24' height='20'/><rect x='8' y='10' width='6' height='6'/><rect x='18' y='10' width='6' height='6'/></svg>",
+}
+ICON_NAMES = tuple(ICON_SVGS)
+ICON_INDEX = {name: i for i, name in enumerate(ICON_NAMES)}
+
+# Shapes that don't carry a fill yet, so re-colorizing can't double it up
+_FILL_RE = re.compile(r"<(path|circle|rect)(?![^>]*fill=)")
+
+@lru_cache(maxsize=512)
+def colorize_svg(svg: str, fill: str) -> str:
+    return _FILL_RE.sub(lambda m: f"<{m.group(1)} fill='{fill}'", svg)
+
+# Icons come from a fixed set and colors from a picker, so results repeat a lot
+@lru_cache(maxsize=512)
+def colorized_icon(icon_name: str, fill: str) -> str:
+    return colorize_svg(ICON_SVGS[icon_name], fill)
+
+@lru_cache(maxsize=512)
+def icon_html(icon_name: str, fill: str, size: int) -> str:
+    # Size the <svg> itself rather than wrapping it in a sized <div>
+    return colorized_icon(icon_name, fill).replace("<svg", f"<svg width='{size}' height='{size}'", 1)
+
+# The add panel starts on this color, so most icons are placed with it:
+# colorize it for every icon once at import instead of on first click.
+DEFAULT_ICON_COLOR = "#111111"
+for _icon_name in ICON_NAMES:
+    colorized_icon(_icon_name, DEFAULT_ICON_COLOR)
+
+# --------------------------------
+# Label HTML templates
+# --------------------------------
+# Shared look goes in one stylesheet (LABEL_CSS, added to the map header);
+# only the per-label values stay inline.
+LABEL_CSS = (
+    ".lbl-label{font-weight:700;padding:2px 6px;border:1px solid currentColor;border-radius:3px}"
+    ".lbl-outlined{font-weight:800;-webkit-text-stroke:2px #fff;text-shadow:0 0 2px #fff}"
+    ".lbl-filled{font-weight:800;border:2px solid currentColor;padding:4px 8px;border-radius:3px}"
+)
+LABEL_TMPL = "<div class='lbl-label' style='font-size:{size}px;color:{color};background:{bg}'>{text}</div>"
+OUTLINED_TMPL = "<div class='lbl-outlined' style='font-size:{size}px;color:{color}'>{text}</div>"
+FILLED_TMPL = "<div class='lbl-filled' style='font-size:{size}px;color:{color};background:{fill}'>{text}</div>"
+_TMPLS = {"Label": LABEL_TMPL, "Outlined": OUTLINED_TMPL}
+
+@lru_cache(maxsize=1024)
+def _label_html(style, size, color, text, bg_hex, bg_alpha, fillcolor) -> str:
+    # Anything that isn't Label/Outlined renders as the filled badge
+    tmpl = _TMPLS.get(style, FILLED_TMPL)
+    bg = rgba_from_hex(bg_hex, bg_alpha) if style == "Label" else ""
+    return tmpl.format_map({
+        "size": size,
+        "color": color,
+        "bg": bg,
+        "fill": fillcolor,
+        "text": text,
+    })
+
+def label_html(lab: dict) -> str:
+    return _label_html(
+        lab.get("style", "Label"), lab.get("size", 16), lab.get("color", "#111"), lab["text"],
+        lab.get("bg_hex", "#FFFFFF"), lab.get("bg_alpha", 0.8), lab.get("fillcolor", "#f6a500"),
+    )